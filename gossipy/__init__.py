@@ -18,6 +18,7 @@ __status__ = "Development"
 
 __all__ = ["LOG",
            "CACHE",
+           "CACHE_ENABLED",
            #"node",
            #"simul",
            #"utils",
@@ -90,6 +91,22 @@ class GlobalSettings(metaclass=Singleton):
         """
         return self._device
 
+    def set_tf32(self, enabled: bool) -> None:
+        """Allow (or forbid) TF32 tensor cores for the matrix multiplications on CUDA devices.
+
+        TF32 (Ampere GPUs or newer) speeds up the float32 matrix multiplications and convolutions
+        at the cost of a reduced precision. Note that this is a process-wide torch setting, thus
+        it also affects the code outside gossipy.
+
+        Parameters
+        ----------
+        enabled : bool
+            Whether TF32 is allowed.
+        """
+
+        torch.backends.cuda.matmul.allow_tf32 = enabled
+        torch.backends.cudnn.allow_tf32 = enabled
+
 # Undocumented class
 class DuplicateFilter(object):
     # docstr-coverage:excused `internal class to handle logging`
@@ -132,6 +149,8 @@ def set_seed(seed=0) -> None:
 
 
 class Sizeable(ABC):
+    __slots__ = ()
+
     def __init__(self):
         """The interface for objects that can be sized.
         
@@ -386,3 +405,12 @@ If a model is needed by another node, it is retrieved from the cache and only on
 If a model is not referenced anymore, it is automatically removed from the cache.
 The models contained in the cache are a deep copy of the models stored in the nodes.
 """
+
+CACHE_ENABLED = True
+"""Whether the exchanged models go through :data:`CACHE`.
+
+If True (default), messages carry a :class:`CacheKey` and a single copy of each model is stored
+in :data:`CACHE` until all its receivers retrieved it. If False, each message carries its own copy
+of the model handler, which avoids the cache bookkeeping but keeps one copy alive per message in
+flight (i.e., memory grows with the number of pending messages).
+"""
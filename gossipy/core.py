@@ -1,5 +1,5 @@
 from abc import ABC, abstractmethod
-from typing import Any, List, Optional, Tuple, Union
+from typing import Any, Optional, Tuple, Union
 from collections import defaultdict
 from enum import Enum
 import numpy as np
@@ -73,6 +73,9 @@ class MessageType(Enum):
         model to the receiver."""
 
 class Message(Sizeable):
+    # Messages are created by the thousands: slots make them smaller and faster to build
+    __slots__ = ("timestamp", "sender", "receiver", "type", "value")
+
     def __init__(self,
                  timestamp: int,
                  sender: int,
@@ -149,6 +152,8 @@ class Message(Sizeable):
         return s
 
 class ChordMessage(Sizeable):
+    __slots__ = ("timestamp", "sender", "receiver", "limit", "type", "value")
+
     def __init__(self,
                  timestamp: int,
                  sender: int,
@@ -365,22 +370,32 @@ class P2PNetwork(ABC):
         
         self._num_nodes = num_nodes
         self._topology = {}
+        self._csr = None
 
         if topology is not None:
+            # The adjacency lists are stored once in CSR format and each node's peers are a view
             if isinstance(topology, np.ndarray):
-                for node in range(num_nodes):
-                    self._topology[node] = list(np.where(topology[node, :] > 0)[-1])
-            elif isinstance(topology, csr_matrix):
-                for node in range(num_nodes):
-                    self._topology[node] = list(topology.getrow(node).nonzero()[-1])
+                rows, cols = np.nonzero(topology > 0)
+            else:
+                rows, cols = csr_matrix(topology).nonzero()
+            offsets = np.zeros(num_nodes + 1, dtype=int)
+            offsets[1:] = np.cumsum(np.bincount(rows, minlength=num_nodes))
+            neighbors = cols.astype(int)
+            neighbors.flags.writeable = False
+            if self._has_static_peers():
+                # otherwise the CSR arrays are built from the overridden get_peers
+                self._csr = (offsets, neighbors)
+            for node in range(num_nodes):
+                self._topology[node] = neighbors[offsets[node]:offsets[node + 1]]
         else:
             #self._topology = {i: None for i in range(num_nodes)}
             self._topology = defaultdict(lambda: range(num_nodes))
+        self._fully_connected = topology is None
 
     # docstr-coverage:inherited
     def size(self, node: Optional[int]=None) -> int:
         if node:
-            return len(self._topology[node]) if self._topology[node] else self._num_nodes - 1
+            return len(self._topology[node]) if len(self._topology[node]) else self._num_nodes - 1
         return self._num_nodes
 
     @abstractmethod
@@ -395,6 +410,75 @@ class P2PNetwork(ABC):
 
         pass
 
+    def get_peers_csr(self) -> Tuple[np.ndarray, np.ndarray]:
+        """Returns the peers of all the nodes in compressed sparse row (CSR) format.
+
+        The peers of node ``i`` are ``neighbors[offsets[i]:offsets[i+1]]``. The arrays are computed
+        only once, thus the topology is assumed to be static: networks whose topology changes
+        must call :meth:`invalidate_peers` after every change.
+
+        Returns
+        -------
+        Tuple[np.ndarray, np.ndarray]
+            The arrays ``offsets`` (of size ``num_nodes + 1``) and ``neighbors``.
+        """
+
+        if self._csr is None:
+            peers = [np.asarray(self.get_peers(i), dtype=int) for i in range(self._num_nodes)]
+            offsets = np.zeros(self._num_nodes + 1, dtype=int)
+            offsets[1:] = np.cumsum([len(p) for p in peers])
+            neighbors = np.concatenate(peers) if peers else np.zeros(0, dtype=int)
+            self._csr = (offsets, neighbors)
+        return self._csr
+
+    def _has_static_peers(self) -> bool:
+        # True if the peers are those of the topology given at construction, i.e., get_peers
+        # is not overridden by a subclass.
+        return type(self).get_peers is StaticP2PNetwork.get_peers
+
+    def invalidate_peers(self) -> None:
+        """Invalidates the cached peers of all the nodes (see :meth:`get_peers_csr`).
+
+        The CSR arrays are rebuilt from :meth:`get_peers` the next time they are needed.
+        """
+
+        self._csr = None
+
+    def sample_peers(self, nodes: np.ndarray) -> np.ndarray:
+        """Samples uniformly at random one peer for each of the given nodes.
+
+        This is the vectorized version of :meth:`gossipy.node.GossipNode.get_peer`: nodes without
+        peers get a random node other than themselves.
+
+        Parameters
+        ----------
+        nodes : np.ndarray
+            The node identifiers.
+
+        Returns
+        -------
+        np.ndarray
+            The sampled peer of each node.
+        """
+
+        nodes = np.asarray(nodes, dtype=int)
+        if self._fully_connected and self._has_static_peers():
+            return np.random.randint(0, self._num_nodes, size=len(nodes))
+
+        offsets, neighbors = self.get_peers_csr()
+        start = offsets[nodes]
+        degree = offsets[nodes + 1] - start
+        peers = np.empty(len(nodes), dtype=int)
+        has_peers = degree > 0
+        if has_peers.any():
+            sel = np.random.randint(0, degree[has_peers])
+            peers[has_peers] = neighbors[start[has_peers] + sel]
+        if not has_peers.all():
+            alone = nodes[~has_peers]
+            other = np.random.randint(0, self._num_nodes - 1, size=len(alone))
+            peers[~has_peers] = other + (other >= alone)
+        return peers
+
 class StaticP2PNetwork(P2PNetwork):
     def __init__(self, num_nodes: int, topology: Optional[Union[np.ndarray, csr_matrix]]=None):
         """A class representing a static network topology.
@@ -411,9 +495,11 @@ class StaticP2PNetwork(P2PNetwork):
         """
         super().__init__(num_nodes, topology)
 
-    def get_peers(self, node_id: int) -> List[int]:
+    def get_peers(self, node_id: int) -> Union[np.ndarray, range]:
         """Returns the peers of a node according to the static network topology.
 
+        The returned array is a read-only view shared by all the users of the network.
+
         Parameters
         ----------
         node_id : int
@@ -2,16 +2,20 @@
 
 import os
 from abc import ABC, abstractmethod
-from typing import Any, Tuple, Union, Dict, List, Optional
+from typing import Any, Iterator, Tuple, Union, Dict, List, Optional
 import shutil
+import threading
+import weakref
+from queue import Full, Queue
+from functools import lru_cache
 import numpy as np
-from numpy.random import randint, shuffle, power, choice, dirichlet, permutation
 import pandas as pd
 from pathlib import Path
 from pyparsing import ParseSyntaxException
 import torch
 import torchvision
 from torch import Tensor, tensor
+from scipy.sparse import issparse, csr_matrix
 from sklearn import datasets
 from sklearn.datasets import load_svmlight_file
 from sklearn.preprocessing import StandardScaler, LabelEncoder
@@ -34,6 +38,7 @@ __status__ = "Development"
 __all__ = ["DataHandler",
            "DataDispatcher",
            "RecSysDataDispatcher",
+           "PrefetchedDataDispatcher",
            "load_classification_dataset",
            "load_recsys_dataset",
            "get_CIFAR10",
@@ -158,20 +163,58 @@ class DataHandler(ABC):
 
 
 class AssignmentHandler():
+    _label_index_cache: Optional[Tuple[weakref.ref, int, Tuple[np.ndarray, List[np.ndarray]]]] = None
 
     def __init__(self, seed: int):
-        torch.manual_seed(seed)
-        np.random.seed(seed)
+        self.rng = np.random.default_rng(seed)
+
+    def _group_by_assignment(self,
+                             assignment: np.ndarray,
+                             n: int) -> List[np.ndarray]:
+        # Groups the examples' ids by client with a single (stable) sort instead of
+        # scanning the whole assignment once per client.
+        assignment = assignment.astype(np.intp, copy=False)
+        order = np.argsort(assignment, kind="stable")
+        counts = np.bincount(assignment, minlength=n)[:n]
+        return np.split(order[:counts.sum()], np.cumsum(counts)[:-1])
+
+    def _index_by_label(self,
+                        y: Union[np.ndarray, torch.Tensor]) -> Tuple[np.ndarray, List[np.ndarray]]:
+        # Returns the (sorted) distinct labels and, for each of them, the ids of its examples.
+        # The result for a labels' tensor is shared across handlers until the tensor is modified
+        # (its version changes), so repeated assignments over the same data do not re-sort it.
+        # The shared arrays are read-only.
+        cache = AssignmentHandler._label_index_cache
+        if isinstance(y, torch.Tensor) and cache is not None and \
+           cache[0]() is y and cache[1] == y._version:
+            return cache[2]
+
+        y_np = y.cpu().numpy() if isinstance(y, torch.Tensor) else np.asarray(y)
+        labels, inverse = np.unique(y_np, return_inverse=True)
+        res = labels, self._group_by_assignment(inverse.ravel(), len(labels))
+        if isinstance(y, torch.Tensor):
+            for arr in [labels] + res[1]:
+                arr.flags.writeable = False
+            AssignmentHandler._label_index_cache = (weakref.ref(y, AssignmentHandler._drop_label_index),
+                                                    y._version, res)
+        return res
+
+    @staticmethod
+    def _drop_label_index(ref: weakref.ref) -> None:
+        # The cached index is released together with its labels' tensor
+        cache = AssignmentHandler._label_index_cache
+        if cache is not None and cache[0] is ref:
+            AssignmentHandler._label_index_cache = None
     
     def uniform(self,
-                y: Union[np.ndarray, torch.Tensor],
+                y: Union[int, np.ndarray, torch.Tensor],
                 n: int) -> List[np.ndarray]:
         """Distribute the examples uniformly across the users.
 
         Parameters
         ----------
-        y: Union[np.ndarray, torch.Tensor]
-            The labels. Not used.
+        y: Union[int, np.ndarray, torch.Tensor]
+            The labels (not used) or directly the number of examples.
         n: int
             The number of clients upon which the examples are distributed.
 
@@ -180,12 +223,13 @@ class AssignmentHandler():
         List[np.ndarray]
             The examples' ids assignment.
         """
-        ex_client = y.shape[0] // n
-        idx = permutation(y.shape[0])
+        n_ex = int(y) if isinstance(y, (int, np.integer)) else y.shape[0]
+        ex_client = n_ex // n
+        idx = self.rng.permutation(n_ex)
         return [idx[range(ex_client*i, ex_client*(i+1))] for i in range(n)]
 
     def quantity_skew(self,
-                      y: Union[np.ndarray, torch.Tensor],
+                      y: Union[int, np.ndarray, torch.Tensor],
                       n: int,
                       min_quantity: int=2,
                       alpha: float=4.) -> List[np.ndarray]:
@@ -201,8 +245,8 @@ class AssignmentHandler():
 
         Parameters
         ----------
-        y: Union[np.ndarray, torch.Tensor]
-            The labels. Not used.
+        y: Union[int, np.ndarray, torch.Tensor]
+            The labels (not used) or directly the number of examples.
         n: int
             The number of clients upon which the examples are distributed.
         min_quantity: int, default 2
@@ -215,13 +259,17 @@ class AssignmentHandler():
         List[np.ndarray]
             The examples' ids assignment.
         """
-        assert min_quantity*n <= y.shape[0], "# of instances must be > than min_quantity*n"
+        n_ex = int(y) if isinstance(y, (int, np.integer)) else y.shape[0]
+        assert min_quantity*n <= n_ex, "# of instances must be > than min_quantity*n"
         assert min_quantity > 0, "min_quantity must be >= 1"
-        s = np.array(power(alpha, y.shape[0] - min_quantity*n) * n, dtype=int)
-        m = np.array([[i] * min_quantity for i in range(n)]).flatten()
-        assignment = np.concatenate([s, m])
-        shuffle(assignment)
-        return [np.where(assignment == i)[0] for i in range(n)]
+        s = (self.rng.power(alpha, n_ex - min_quantity*n) * n).astype(np.intp, copy=False)
+        m = np.repeat(np.arange(n, dtype=np.intp), min_quantity)
+        # Only the number of examples per client matters: the examples themselves are
+        # picked by slicing a random permutation of the ids.
+        counts = np.bincount(np.concatenate([s, m]), minlength=n)[:n]
+        offsets = np.concatenate([[0], np.cumsum(counts)])
+        perm = self.rng.permutation(n_ex)
+        return [perm[offsets[i]:offsets[i+1]] for i in range(n)]
 
     def classwise_quantity_skew(self,
                                 y: Union[np.ndarray, torch.Tensor],
@@ -230,25 +278,26 @@ class AssignmentHandler():
                                 alpha: float=4.) -> List[np.ndarray]:
         assert min_quantity*n <= y.shape[0], "# of instances must be > than min_quantity*n"
         assert min_quantity > 0, "min_quantity must be >= 1"
-        labels = list(range(len(torch.unique(y).numpy())))
-        lens = [np.where(y == l)[0].shape[0] for l in labels]
+        _, label_ids = self._index_by_label(y)
+        labels = list(range(len(label_ids)))
+        lens = [len(ids) for ids in label_ids]
         min_lbl = min(lens)
         assert min_lbl >= n, "Under represented class!"
 
-        s = [np.array(power(alpha, lens[c] - n) * n, dtype=int) for c in labels]
+        s = [(self.rng.power(alpha, lens[c] - n) * n).astype(np.intp, copy=False) for c in labels]
         assignment = []
         for c in labels:
-            ass = np.concatenate([s[c], list(range(n))])
-            shuffle(ass)
+            ass = np.concatenate([s[c], np.arange(n, dtype=np.intp)])
+            self.rng.shuffle(ass)
             assignment.append(ass)
 
         res = [[] for _ in range(n)]
         for c in labels:
-            idc = np.where(y == c)[0]
-            for i in range(n):
-                res[i] += list(idc[np.where(assignment[c] == i)[0]])
+            idc = label_ids[c]
+            for i, ids in enumerate(self._group_by_assignment(assignment[c], n)):
+                res[i].append(idc[ids])
 
-        return [np.array(r, dtype=int) for r in res]
+        return [np.concatenate(r).astype(int) if r else np.empty(0, dtype=int) for r in res]
 
     def label_quantity_skew(self,
                             y: Union[np.ndarray, torch.Tensor],
@@ -276,22 +325,23 @@ class AssignmentHandler():
         List[np.ndarray]
             The examples' ids assignment.
         """
-        labels = set(torch.unique(y).numpy())
+        _, label_ids = self._index_by_label(y)
+        labels = np.arange(len(label_ids))
         assert 0 < class_per_client <= len(labels), "class_per_client must be > 0 and <= #classes"
         assert class_per_client * n >= len(labels), "class_per_client * n must be >= #classes"
-        nlbl = [choice(len(labels), class_per_client, replace=False)  for u in range(n)]
-        check = set().union(*[set(a) for a in nlbl])
-        while len(check) < len(labels):
-            missing = labels - check
-            for m in missing:
-                nlbl[randint(0, n)][randint(0, class_per_client)] = m
-            check = set().union(*[set(a) for a in nlbl])
-        class_map = {c:[u for u, lbl in enumerate(nlbl) if c in lbl] for c in labels}
+        nlbl = np.stack([self.rng.choice(len(labels), class_per_client, replace=False) for _ in range(n)])
+        missing = np.setdiff1d(labels, nlbl)
+        while len(missing):
+            nlbl[self.rng.integers(0, n, len(missing)),
+                 self.rng.integers(0, class_per_client, len(missing))] = missing
+            missing = np.setdiff1d(labels, nlbl)
+        owners = np.zeros((len(labels), n), dtype=bool)
+        owners[nlbl, np.arange(n)[:, None]] = True
         assignment = np.zeros(y.shape[0])
-        for lbl, users in class_map.items():
-            ids = np.where(y == lbl)[0]
-            assignment[ids] = choice(users, len(ids))
-        return [np.where(assignment == i)[0] for i in range(n)]
+        for lbl in labels:
+            ids = label_ids[lbl]
+            assignment[ids] = self.rng.choice(np.flatnonzero(owners[lbl]), len(ids))
+        return self._group_by_assignment(assignment, n)
 
     def label_dirichlet_skew(self,
                              y: torch.Tensor,
@@ -318,17 +368,16 @@ class AssignmentHandler():
             The examples' ids assignment.
         """
         assert beta > 0, "beta must be > 0"
-        labels = set(torch.unique(y).numpy())
-        pk = {c: dirichlet([beta]*n, size=1)[0] for c in labels}
+        _, label_ids = self._index_by_label(y)
+        labels = range(len(label_ids))
+        pk = self.rng.dirichlet(np.full(n, beta), size=len(label_ids))
         assignment = np.zeros(y.shape[0])
         for c in labels:
-            ids = np.where(y == c)[0]
-            shuffle(ids)
-            shuffle(pk[c])
-            assignment[ids[n:]] = choice(n, size=len(ids)-n, p=pk[c])
+            ids = self.rng.permutation(label_ids[c])
+            assignment[ids[n:]] = self.rng.choice(n, size=len(ids)-n, p=pk[c])
             assignment[ids[:n]] = list(range(n))
 
-        return [np.where(assignment == i)[0] for i in range(n)]
+        return self._group_by_assignment(assignment, n)
 
     def label_pathological_skew(self,
                                 y: Union[np.ndarray, torch.Tensor],
@@ -354,19 +403,15 @@ class AssignmentHandler():
         List[np.ndarray]
             The examples' ids assignment.
         """
-        sorted_ids = np.argsort(y)
+        sorted_ids = np.concatenate(self._index_by_label(y)[1])
         n_shards = int(shards_per_client * n)
         shard_size = int(np.ceil(len(y) / n_shards))
-        assignments = np.zeros(y.shape[0])
-        perm = permutation(n_shards)
-        j = 0
-        for i in range(n):
-            for _ in range(shards_per_client):
-                left = perm[j] * shard_size
-                right = min((perm[j]+1) * shard_size, len(y))
-                assignments[sorted_ids[left:right]] = i
-                j += 1
-        return [np.where(assignments == i)[0] for i in range(n)]
+        perm = self.rng.permutation(n_shards)
+        shard_to_client = np.empty(n_shards, dtype=np.intp)
+        shard_to_client[perm] = np.repeat(np.arange(n), shards_per_client)
+        assignments = np.empty(y.shape[0], dtype=np.intp)
+        assignments[sorted_ids] = np.repeat(shard_to_client, shard_size)[:len(y)]
+        return self._group_by_assignment(assignments, n)
 
 
 class DataDispatcher():
@@ -440,9 +485,9 @@ class DataDispatcher():
         """
 
         assign_handler = AssignmentHandler(seed)
-        self.tr_assignments = assign_handler.uniform(self.data_handler.ytr, self.n)
+        self.tr_assignments = assign_handler.uniform(self.data_handler.size(), self.n)
         if self.eval_on_user:
-            self.te_assignments = assign_handler.uniform(self.data_handler.yte, self.n)
+            self.te_assignments = assign_handler.uniform(self.data_handler.eval_size(), self.n)
         else:
             self.te_assignments = [[] for _ in range(self.n)]
 
@@ -464,6 +509,41 @@ class DataDispatcher():
         assert 0 <= idx < self.n, "Index %d out of range." %idx
         return self.data_handler.at(self.tr_assignments[idx]), \
                self.data_handler.at(self.te_assignments[idx], True)
+
+    def _gather(self, assignments: List[Any], eval_set: bool) -> List[Any]:
+        # Gathers the data of all the clients at once, and splits it into per-client views.
+        counts = np.fromiter((len(a) for a in assignments), dtype=np.intp, count=self.n)
+        if not counts.any():
+            return [self.data_handler.at(a, eval_set) for a in assignments]
+        offsets = np.concatenate([[0], np.cumsum(counts)])
+        data = self.data_handler.at(np.concatenate(assignments).astype(np.intp), eval_set)
+        if isinstance(data, tuple):
+            return [tuple(d[offsets[i]:offsets[i+1]] for d in data) for i in range(self.n)]
+        return [data[offsets[i]:offsets[i+1]] for i in range(self.n)]
+
+    def iter_clients(self) -> Iterator[Any]:
+        """Iterates over the data of the clients, in order of index.
+
+        Differently from accessing the clients one by one (see :meth:`__getitem__`), the
+        training (and test) examples of all the clients are selected with a single call to
+        the data handler, and then split among the clients. Subclasses that override
+        :meth:`__getitem__` are iterated client by client through it.
+
+        Yields
+        ------
+        Any
+            The data assigned to each client, in the same format returned by :meth:`__getitem__`.
+        """
+
+        if type(self).__getitem__ is not DataDispatcher.__getitem__:
+            for i in range(self.n):
+                yield self[i]
+            return
+
+        tr_data = self._gather(self.tr_assignments, False)
+        te_data = self._gather(self.te_assignments, True)
+        for i in range(self.n):
+            yield tr_data[i], te_data[i]
     
     def size(self) -> int:
         """Returns the number of clients.
@@ -528,16 +608,18 @@ class RecSysDataDispatcher(DataDispatcher):
     
     # docstr-coverage:inherited
     def assign(self, seed=42):
-        torch.manual_seed(seed)
-        self.assignments = torch.randperm(self.data_handler.size()).tolist()
+        gen = torch.Generator()
+        gen.manual_seed(seed)
+        self.assignments = torch.randperm(self.data_handler.size(), generator=gen)
 
 
     # docstr-coverage:inherited
     def __getitem__(self, idx: int) -> Any:
         assert(0 <= idx < self.n), "Index %d out of range." %idx
-        return self.data_handler.at(self.assignments[idx]), \
-               self.data_handler.at(self.assignments[idx], True)
-    
+        user = int(self.assignments[idx])
+        return self.data_handler.at(user), \
+               self.data_handler.at(user, True)
+
     # docstr-coverage:inherited
     def size(self) -> int:
         return self.n
@@ -554,10 +636,180 @@ class RecSysDataDispatcher(DataDispatcher):
         return f"RecSysDataDispatcher(handler={self.data_handler}, eval_on_user={self.eval_on_user})"
 
 
+class PrefetchedDataDispatcher(DataDispatcher):
+    def __init__(self,
+                 dispatcher: DataDispatcher,
+                 prefetch: int=2,
+                 device: Optional[Union[str, torch.device]]=None):
+        """PrefetchedDataDispatcher wraps a dispatcher and prepares the clients' data in background.
+
+        A daemon thread materializes the data of the clients in increasing order of index (which
+        is the order used by :meth:`gossipy.node.GossipNode.generate`) and keeps at most
+        ``prefetch`` of them ready. The thread is started by the first in-order access, every call
+        of :meth:`iter_clients` restarts it from the first client, and it can be stopped with
+        :meth:`close`. If ``device`` is a CUDA device, the data is also copied to
+        the device using a separate CUDA stream, so that the copy overlaps with the work done on
+        the data of the previous client. Clients requested out of order are served synchronously.
+
+        Parameters
+        ----------
+        dispatcher : DataDispatcher
+            The data dispatcher to wrap. Its assignments must be already set. The data is always
+            loaded through the wrapped dispatcher (see :meth:`DataDispatcher.__getitem__`), thus
+            any dispatcher (e.g., :class:`RecSysDataDispatcher`) can be wrapped.
+        prefetch : int, default=2
+            The maximum number of clients' data prepared in advance.
+        device : str or torch.device, default=None
+            The device where to move the data. If None, the data is left where it is.
+        """
+
+        assert prefetch > 0, "prefetch must be > 0"
+        super(PrefetchedDataDispatcher, self).__init__(dispatcher.data_handler,
+                                                       dispatcher.n,
+                                                       dispatcher.eval_on_user,
+                                                       auto_assign=False)
+        self.dispatcher = dispatcher
+        self.n = dispatcher.n
+        self.prefetch = prefetch
+        self.device = torch.device(device) if device is not None else None
+        self._stream = torch.cuda.Stream(self.device) \
+            if self.device is not None and self.device.type == "cuda" else None
+        self._queue = None
+        self._stop = None
+        self._worker = None
+        self._sync_assignments()
+
+    def _to_device(self, data: Any) -> Any:
+        if isinstance(data, torch.Tensor):
+            if self._stream is not None:
+                return data.pin_memory().to(self.device, non_blocking=True)
+            return data.to(self.device)
+        if isinstance(data, (tuple, list)):
+            return type(data)(self._to_device(d) for d in data)
+        return data
+
+    def _load(self, idx: int) -> Any:
+        data = self.dispatcher[idx]
+        if self.device is None:
+            return data
+        if self._stream is not None:
+            with torch.cuda.stream(self._stream):
+                data = self._to_device(data)
+            event = torch.cuda.Event()
+            event.record(self._stream)
+            return data, event
+        return self._to_device(data)
+
+    def _start(self) -> None:
+        # the worker prefetches from the next client to be consumed
+        self._queue = Queue(maxsize=self.prefetch)
+        self._stop = threading.Event()
+        self._worker = threading.Thread(target=self._produce,
+                                        args=(self._next, self._queue, self._stop),
+                                        daemon=True)
+        self._worker.start()
+
+    def _produce(self, first: int, queue: Queue, stop: threading.Event) -> None:
+        for idx in range(first, self.n):
+            try:
+                item = (idx, self._load(idx), None)
+            except Exception as e:
+                item = (idx, None, e)
+            while not stop.is_set():
+                try:
+                    queue.put(item, timeout=.1)
+                    break
+                except Full:
+                    pass
+            # the worker stops after an error: the next in-order access restarts it
+            if stop.is_set() or item[2] is not None:
+                return
+
+    def close(self) -> None:
+        """Stops the prefetching thread.
+
+        The data already prefetched is discarded. The thread is restarted by the next in-order
+        access, from the first client that has not been consumed yet.
+        """
+
+        if self._worker is not None:
+            self._stop.set()
+            self._worker.join()
+        self._queue, self._stop, self._worker = None, None, None
+
+    # docstr-coverage:inherited
+    def set_assignments(self, tr_assignments: List[int],
+                              te_assignments: Optional[List[int]]) -> None:
+        self.close()
+        self.dispatcher.set_assignments(tr_assignments, te_assignments)
+        self._sync_assignments()
+
+    # docstr-coverage:inherited
+    def assign(self, seed: Optional[int]=42) -> None:
+        self.close()
+        self.dispatcher.assign(seed)
+        self._sync_assignments()
+
+    def _sync_assignments(self) -> None:
+        # the assignments are those of the wrapped dispatcher, which actually loads the data
+        # (dispatchers such as RecSysDataDispatcher have no training/test assignment lists)
+        self.tr_assignments = getattr(self.dispatcher, "tr_assignments", None)
+        self.te_assignments = getattr(self.dispatcher, "te_assignments", None)
+        self._next = 0
+
+    # docstr-coverage:inherited
+    def __getitem__(self, idx: int) -> Any:
+        assert 0 <= idx < self.n, "Index %d out of range." %idx
+        if idx != self._next:
+            data = self._load(idx)
+        else:
+            if self._worker is None:
+                self._start()
+            _, data, err = self._queue.get()
+            self._next += 1
+            if err is not None:
+                self.close()
+                raise err
+        if self._stream is not None:
+            data, event = data
+            torch.cuda.current_stream(self.device).wait_event(event)
+        return data
+
+    # docstr-coverage:inherited
+    def iter_clients(self) -> Iterator[Any]:
+        # each pass prefetches from the first client
+        if self._next != 0:
+            self.close()
+            self._next = 0
+        for i in range(self.n):
+            yield self[i]
+
+    # docstr-coverage:inherited
+    def get_eval_set(self) -> Tuple[Any, Any]:
+        return self.dispatcher.get_eval_set()
+
+    # docstr-coverage:inherited
+    def has_test(self) -> bool:
+        return self.dispatcher.has_test()
+
+    def __getstate__(self) -> Dict[str, Any]:
+        # threads, queues and streams cannot be pickled: once restored, data is loaded on demand
+        # until the next call of iter_clients
+        state = self.__dict__.copy()
+        state.update(_stream=None, _queue=None, _stop=None, _worker=None, _next=self.n)
+        return state
+
+    def __str__(self) -> str:
+        return "PrefetchedDataDispatcher(dispatcher=%s, prefetch=%d, device=%s)" \
+                %(self.dispatcher, self.prefetch, self.device)
+
+
 def load_classification_dataset(name_or_path: str,
                                 normalize: bool=True,
-                                as_tensor: bool=True) -> Union[Tuple[torch.Tensor, torch.Tensor],
-                                                               Tuple[np.ndarray, np.ndarray]]:
+                                as_tensor: bool=True,
+                                sparse: bool=False) -> Union[Tuple[torch.Tensor, torch.Tensor],
+                                                             Tuple[np.ndarray, np.ndarray],
+                                                             Tuple[csr_matrix, np.ndarray]]:
     """Loads a classification dataset.
 
     A dataset can be loaded from *svmlight* file or can be one of the following:
@@ -571,10 +823,15 @@ def load_classification_dataset(name_or_path: str,
         Whether to normalize (standard scaling) the data or not.
     as_tensor : bool, default=True
         Whether to return the data as a tensor or as a numpy array.
+    sparse : bool, default=False
+        Whether to keep the data sparse when the source is sparse (i.e., *svmlight* files).
+        In such a case the data is returned as a ``scipy.sparse.csr_matrix`` (or a sparse CSR
+        tensor when ``as_tensor=True``) and the normalization does not center the data, since
+        centering would make it dense.
     
     Returns
     -------
-    tuple[torch.Tensor, torch.Tensor] or tuple[np.ndarray, np.ndarray]
+    tuple[torch.Tensor, torch.Tensor] or tuple[np.ndarray, np.ndarray] or tuple[csr_matrix, np.ndarray]
         A tuple containing the data and the labels with the specified type.
     """
 
@@ -586,14 +843,22 @@ def load_classification_dataset(name_or_path: str,
         X = np.delete(data, [label_id], axis=1).astype('float64')
     else:
         X, y = load_svmlight_file(name_or_path)
-        X = X.toarray()
+        if not sparse:
+            X = X.toarray()
 
     if normalize:
-        X = StandardScaler().fit_transform(X)
+        X = StandardScaler(with_mean=not issparse(X)).fit_transform(X)
 
     if as_tensor:
-        X = torch.tensor(X).float()
-        y = torch.tensor(y).long()#.reshape(y.shape[0], 1)
+        if issparse(X):
+            X = X.tocsr()
+            X = torch.sparse_csr_tensor(torch.from_numpy(X.indptr.astype(np.int64)),
+                                        torch.from_numpy(X.indices.astype(np.int64)),
+                                        torch.from_numpy(X.data.astype(np.float32)),
+                                        size=X.shape)
+        else:
+            X = torch.from_numpy(np.ascontiguousarray(X, dtype=np.float32))
+        y = torch.from_numpy(np.ascontiguousarray(y, dtype=np.int64))#.reshape(y.shape[0], 1)
 
     return X, y
 
@@ -619,35 +884,48 @@ def load_recsys_dataset(name: str,
         Ratings are represented as a dictionary mapping user ids to a list of tuples (item id, rating).
     """
 
-    ratings = {}
     if name in {"ml-100k", "ml-1m", "ml-10m", "ml-20m"}:
         # folder = download_and_unzip("https://files.grouplens.org/datasets/movielens/%s.zip" %name)[0]
+        header = None
         if name == "ml-100k":
             filename = "u.data"
-            sep = "\t"
+            sep, cols = "\t", [0, 1, 2]
         elif name == "ml-20m":
             filename = "ratings.csv"
-            sep = ","
+            sep, cols = ",", [0, 1, 2]
+            header = 0
         else:
+            # "::" is split as ":" (empty fields in between) to stick to the C parser
             filename = "ratings.dat"
-            sep = "::"
-
-        ucnt = 0
-        icnt = 0
-        with open("".join(["data/", name, "/", filename]), "r") as f:
-            umap = {}
-            imap = {}
-            for line in f.readlines():
-                u, i, r = list(line.strip().split(sep))[0:3]
-                u, i, r = int(u), int(i), float(r)
-                if u not in umap:
-                    umap[u] = ucnt
-                    ratings[umap[u]] = []
-                    ucnt += 1
-                if i not in imap:
-                    imap[i] = icnt
-                    icnt += 1
-                ratings[umap[u]].append((imap[i], r))
+            sep, cols = ":", [0, 2, 4]
+
+        # the file is parsed in chunks so that the parser buffers stay bounded (ml-20m is ~500MB)
+        reader = pd.read_csv("".join(["data/", name, "/", filename]),
+                             sep=sep,
+                             header=header,
+                             usecols=cols,
+                             names=["user", "item", "rating"],
+                             dtype={"user": np.int64, "item": np.int64, "rating": np.float64},
+                             engine="c",
+                             chunksize=1_000_000)
+        users, items, r = [], [], []
+        for chunk in reader:
+            users.append(chunk["user"].to_numpy())
+            items.append(chunk["item"].to_numpy())
+            r.append(chunk["rating"].to_numpy())
+        r = np.concatenate(r)
+
+        # user/item ids are mapped to indices in order of first appearance
+        u_codes, u_uniq = pd.factorize(np.concatenate(users), sort=False)
+        i_codes, i_uniq = pd.factorize(np.concatenate(items), sort=False)
+        del users, items
+        ucnt, icnt = len(u_uniq), len(i_uniq)
+
+        order = np.argsort(u_codes, kind="stable")
+        splits = np.cumsum(np.bincount(u_codes, minlength=ucnt))[:-1]
+        items = np.split(i_codes[order], splits)
+        values = np.split(r[order], splits)
+        ratings = {u: list(zip(items[u].tolist(), values[u].tolist())) for u in range(ucnt)}
 
         # shutil.rmtree(folder)
     else:
@@ -658,8 +936,9 @@ def load_recsys_dataset(name: str,
 
 
 def get_CIFAR10(path: str="./data",
-                as_tensor: bool=True) -> Union[Tuple[Tuple[np.ndarray, list], Tuple[np.ndarray, list]],
-                                               Tuple[Tuple[Tensor, Tensor], Tuple[Tensor, Tensor]]]:
+                as_tensor: bool=True,
+                force_download: bool=False) -> Union[Tuple[Tuple[np.ndarray, list], Tuple[np.ndarray, list]],
+                                                     Tuple[Tuple[Tensor, Tensor], Tuple[Tensor, Tensor]]]:
     """Returns the CIFAR10 dataset.
 
     The method downloads the dataset if it is not already present in `path`.
@@ -672,35 +951,54 @@ def get_CIFAR10(path: str="./data",
         If True, the dataset is returned as a tuple of pytorch tensors.
         Otherwise, the dataset is returned as a tuple of numpy arrays.
         By default, True.
+    force_download : bool, default=False
+        If True, the dataset is downloaded (and checked) even if it is already present in `path`.
     
     Returns
     -------
     tuple[tuple[np.ndarray, list], tuple[np.ndarray, list]] or tuple[tuple[Tensor, Tensor], tuple[Tensor, Tensor]]
         Tuple of training and test sets of the form :math:`(X_train, y_train), (X_test, y_test)`.
+
+    Notes
+    -----
+    The raw (uint8) data of the most recently loaded dataset is kept in memory, thus repeated
+    calls do not read it again from disk. Each call returns new arrays/tensors.
     """
 
-    download = not Path(os.path.join(path, "/cifar-10-batches-py")).is_dir()
+    if force_download:
+        _load_CIFAR10.cache_clear()
+        (Xtr, ytr), (Xte, yte) = _read_CIFAR10(path, True)
+    else:
+        (Xtr, ytr), (Xte, yte) = _load_CIFAR10(path)
+
+    if as_tensor:
+        # NCHW layout is materialized on the uint8 data, then a single float copy is scaled in-place
+        return (torch.from_numpy(Xtr).permute(0,3,1,2).contiguous().float().div_(255.), tensor(ytr)), \
+               (torch.from_numpy(Xte).permute(0,3,1,2).contiguous().float().div_(255.), tensor(yte))
+    return (Xtr.copy(), list(ytr)), (Xte.copy(), list(yte))
+
+
+@lru_cache(maxsize=1)
+def _load_CIFAR10(path: str):
+    download = not Path(os.path.join(path, "cifar-10-batches-py")).is_dir()
+    return _read_CIFAR10(path, download)
+
+
+def _read_CIFAR10(path: str, download: bool):
+    # Raw (uint8) data: the cached copy is never returned as is
     train_set = torchvision.datasets.CIFAR10(root=path,
                                              train=True,
                                              download=download)
     test_set = torchvision.datasets.CIFAR10(root=path,
                                             train=False,
                                             download=download)
-    if as_tensor:
-        train_set = tensor(train_set.data).float().permute(0,3,1,2) / 255.,\
-                    tensor(train_set.targets)
-        test_set = tensor(test_set.data).float().permute(0,3,1,2) / 255.,\
-                   tensor(test_set.targets)
-    else:
-        train_set = train_set.data, train_set.targets
-        test_set = test_set.data, test_set.targets
-
-    return train_set, test_set
+    return (train_set.data, train_set.targets), (test_set.data, test_set.targets)
 
 
 def get_FashionMNIST(path: str="./data",
-                     as_tensor: bool=True) -> Union[Tuple[Tuple[np.ndarray, list], Tuple[np.ndarray, list]],
-                                                          Tuple[Tuple[Tensor, Tensor], Tuple[Tensor, Tensor]]]:
+                     as_tensor: bool=True,
+                     force_download: bool=False) -> Union[Tuple[Tuple[np.ndarray, list], Tuple[np.ndarray, list]],
+                                                                Tuple[Tuple[Tensor, Tensor], Tuple[Tensor, Tensor]]]:
     """Returns the FashionMNIST dataset.
 
     The method downloads the dataset if it is not already present in `path`.
@@ -713,42 +1011,57 @@ def get_FashionMNIST(path: str="./data",
         If True, the dataset is returned as a tuple of pytorch tensors.
         Otherwise, the dataset is returned as a tuple of numpy arrays.
         By default, True.
+    force_download : bool, default=False
+        If True, the dataset is downloaded (and checked) even if it is already present in `path`.
 
     Returns
     -------
     Tuple[Tuple[np.ndarray, list], Tuple[np.ndarray, list]] or Tuple[Tuple[Tensor, Tensor], Tuple[Tensor, Tensor]]
         Tuple of training and test sets of the form 
         :math:`(X_\text{train}, y_\text{train}), (X_\text{test}, y_\text{test})`.
+
+    Notes
+    -----
+    The raw (uint8) data of the most recently loaded dataset is kept in memory, thus repeated
+    calls do not read it again from disk. Each call returns new arrays/tensors.
     """
 
-    download = not Path(os.path.join(path, "/FashionMNIST/raw/")).is_dir()
+    if force_download:
+        _load_FashionMNIST.cache_clear()
+        (Xtr, ytr), (Xte, yte) = _read_FashionMNIST(path, True)
+    else:
+        (Xtr, ytr), (Xte, yte) = _load_FashionMNIST(path)
+
+    if as_tensor:
+        return (Xtr / 255., ytr.clone()), (Xte / 255., yte.clone())
+    return (Xtr.numpy() / 255., ytr.numpy().copy()), (Xte.numpy() / 255., yte.numpy().copy())
+
+
+@lru_cache(maxsize=1)
+def _load_FashionMNIST(path: str):
+    download = not Path(os.path.join(path, "FashionMNIST", "raw")).is_dir()
+    return _read_FashionMNIST(path, download)
+
+
+def _read_FashionMNIST(path: str, download: bool):
+    # Raw (uint8) data: the cached copy is never returned as is
     train_set = torchvision.datasets.FashionMNIST(root=path,
                                                   train=True,
                                                   download=download)
     test_set = torchvision.datasets.FashionMNIST(root=path,
                                                  train=False,
                                                  download=download)
-    if as_tensor:
-        train_set = train_set.data / 255., train_set.targets
-        test_set = test_set.data / 255., test_set.targets
-    else:
-        train_set = train_set.data.numpy() / 255., train_set.targets.numpy()
-        test_set = test_set.data.numpy() / 255., test_set.targets.numpy()
-
-    return train_set, test_set
+    return (train_set.data, train_set.targets), (test_set.data, test_set.targets)
 
 #UNDOCUMENTED
-def get_FEMNIST(path: str="./data") -> Tuple[Tuple[torch.Tensor, torch.Tensor, List[int]], \
-                                             Tuple[torch.Tensor, torch.Tensor, List[int]]]:
+def get_FEMNIST(path: str="./data") -> Tuple[Tuple[torch.Tensor, torch.Tensor, List[np.ndarray]], \
+                                             Tuple[torch.Tensor, torch.Tensor, List[np.ndarray]]]:
     url = 'https://raw.githubusercontent.com/tao-shen/FEMNIST_pytorch/master/femnist.tar.gz'
     te_name, tr_name = download_and_untar(url, path)
     Xtr, ytr, ids_tr = torch.load(os.path.join(path, tr_name))
     Xte, yte, ids_te = torch.load(os.path.join(path, te_name))
-    tr_assignment = []
-    te_assignment = []
-    sum_tr = sum_te = 0
-    for i in range(len(ids_tr)):
-        ntr, nte = ids_tr[i], ids_te[i]
-        tr_assignment.append(list(range(sum_tr, sum_tr + ntr)))
-        te_assignment.append(list(range(sum_te, sum_te + nte)))
+    tr_offsets = np.concatenate([[0], np.cumsum(np.asarray(ids_tr, dtype=np.intp))])
+    te_offsets = np.concatenate([[0], np.cumsum(np.asarray(ids_te, dtype=np.intp))])
+    tr_assignment = [np.arange(tr_offsets[i], tr_offsets[i+1]) for i in range(len(ids_tr))]
+    te_assignment = [np.arange(te_offsets[i], te_offsets[i+1]) for i in range(len(ids_te))]
     return (Xtr, ytr, tr_assignment), (Xte, yte, te_assignment)
\ No newline at end of file
@@ -29,6 +29,7 @@ class TorchModel(torch.nn.Module, Sizeable, ABC):
         """
 
         super(TorchModel, self).__init__()
+        self._n_params = None
 
     @abstractmethod
     def init_weights(self, *args, **kwargs) -> None:
@@ -37,13 +38,10 @@ class TorchModel(torch.nn.Module, Sizeable, ABC):
         pass
     
     def _get_n_params(self) -> int:
-        pp = 0
-        for p in list(self.parameters()):
-            nn = 1
-            for s in list(p.size()):
-                nn = nn * s
-            pp += nn
-        return pp
+        # The architecture does not change after construction, so the count is memoized
+        if self._n_params is None:
+            self._n_params = sum(p.numel() for p in self.parameters())
+        return self._n_params
     
     def get_size(self) -> int:
         """Returns the number of parameters of the model.
@@ -3,13 +3,14 @@ from abc import ABC, abstractmethod
 import copy
 import torch
 from torch import LongTensor
-from torch.nn import ParameterList, Parameter
+from torch.nn import ParameterList
 import numpy as np
 from typing import Any, Callable, Tuple, Dict, Optional, Union, Iterable
 from sklearn.metrics import accuracy_score, roc_auc_score, recall_score, f1_score, precision_score
 from sklearn.metrics.cluster import normalized_mutual_info_score as nmi
 from scipy.optimize import linear_sum_assignment as hungarian
 
+import gossipy
 from .. import CACHE, LOG, CacheKey, GlobalSettings, Sizeable
 from ..core import CreateModelMode
 from . import TorchModel
@@ -157,9 +158,12 @@ class ModelHandler(Sizeable, ModelEqualityMixin, ABC):
 
         return self.model.get_size() if self.model is not None else 0
     
-    def caching(self, owner: int) -> CacheKey:
+    def caching(self, owner: int) -> Union[CacheKey, ModelHandler]:
         """Cache the model handler and return the cache key.
 
+        If caching is disabled (see :data:`gossipy.CACHE_ENABLED`), the copy of the model handler
+        is returned in place of the key.
+
         Parameters
         ----------
         owner : int
@@ -167,10 +171,13 @@ class ModelHandler(Sizeable, ModelEqualityMixin, ABC):
         
         Returns
         -------
-        CacheKey
-            The cache key corresponding to this model handler in the cache.
+        CacheKey or ModelHandler
+            The cache key corresponding to this model handler in the cache, or a copy of the model
+            handler if caching is disabled.
         """
 
+        if not gossipy.CACHE_ENABLED:
+            return self.copy()
         key = CacheKey(owner, self.n_updates)
         CACHE.push(key, self.copy())
         return key
@@ -366,8 +373,7 @@ class AdaLineHandler(ModelHandler):
             self.model.model += self.learning_rate * (y[i] - self.model(x[i:i+1])) * x[i]
     
     def _merge(self, other_model_handler: PegasosHandler) -> None:
-        self.model.model = Parameter(0.5 * (self.model.model + other_model_handler.model.model),
-                                     requires_grad=False)
+        self.model.model = 0.5 * (self.model.model + other_model_handler.model.model)
         self.n_updates = max(self.n_updates, other_model_handler.n_updates)
 
     def evaluate(self,
@@ -508,13 +514,16 @@ class PartitionedTMH(TorchModelHandler):
         
     def _adjust_gradient(self) -> None:
         plist = ParameterList(self.model.parameters())
+        n_updates = torch.from_numpy(self.n_updates)
         with torch.no_grad():
-            for p, t_ids in self.tm_partition.partitions.items():
-                for i, par in enumerate(plist):
-                    if t_ids[i] is not None:
-                        par.grad[t_ids[i]] /= self.n_updates[p]
-
-    def caching(self, owner: int) -> CacheKey:
+            # each gradient is divided by the number of updates of its partition
+            for par, owners in zip(plist, self.tm_partition.owners):
+                par.grad.view(-1).div_(n_updates[owners].to(par.grad))
+
+    # docstr-coverage:inherited
+    def caching(self, owner: int) -> Union[CacheKey, ModelHandler]:
+        if not gossipy.CACHE_ENABLED:
+            return self.copy()
         key = CacheKey(owner, str(self.n_updates))
         CACHE.push(key, self.copy())
         return key
@@ -670,12 +679,15 @@ class WeightedTMH(TorchModelHandler):
 
         # Perform the average overall models including its weights
         # CHECK: whether to allow the merging of the other models before the averaging 
-        for key in dict_params1:
-            dict_params1[key] *= weights[0]
-            for i, dict_params2 in enumerate(dicts_params2):
-                dict_params1[key] += dict_params2[key] * weights[i + 1]
+        # The state dict tensors share the storage with the model, so the (weighted) average is
+        # computed in place with multi-tensor ops: one call per model rather than per tensor
+        # (the models share the architecture, thus their state dicts list the tensors in the same order)
+        params1 = list(dict_params1.values())
+        weights = [float(w) for w in weights]
+        torch._foreach_mul_(params1, weights[0])
+        for i, dict_params2 in enumerate(dicts_params2):
+            torch._foreach_add_(params1, list(dict_params2.values()), alpha=weights[i + 1])
 
-        self.model.load_state_dict(dict_params1)
         # Gets the maximum number of updates from the merged models
         self.n_updates = max(self.n_updates, n_up)
 
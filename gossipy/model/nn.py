@@ -1,9 +1,11 @@
-from collections import OrderedDict
+import math
 import torch
-from torch.nn import Module, Linear, Sequential
-from torch.nn.init import xavier_uniform_
+from torch.nn import Module, Linear, Parameter, Sequential
+import torch.nn.functional as F
+from torch.nn.init import xavier_uniform_, uniform_, kaiming_uniform_
+from torch.ao.quantization import quantize_dynamic
 from torch.nn.modules.activation import ReLU, Sigmoid
-from typing import Tuple
+from typing import Any, Dict, List, Optional, Tuple
 from . import TorchModel
 
 # AUTHORSHIP
@@ -23,11 +25,41 @@ __all__ = ["TorchPerceptron",
            #"Pegasos",
            "LogisticRegression"]
 
+
+def _autocast() -> torch.autocast:
+    # Mixed precision (bfloat16) forward pass for the models created with autocast=True, entered
+    # only on CUDA devices. Parameters stay in float32 and the outputs are cast back to float32.
+    return torch.autocast(device_type="cuda", dtype=torch.bfloat16)
+
+
+def _chain_linear(x: torch.Tensor,
+                  weights: torch.Tensor,
+                  biases: torch.Tensor,
+                  activation: Module) -> torch.Tensor:
+    # Chain of equally shaped linear layers (stacked weights) followed by the activation
+    for k in range(weights.shape[0]):
+        x = activation(F.linear(x, weights[k], biases[k]))
+    return x
+
+
+_compiled_chain_linear = None
+
+
+def _get_compiled_chain_linear():
+    # _chain_linear compiled into a single graph. It is compiled on first use since importing
+    # the compiler (torch._dynamo) is slow.
+    global _compiled_chain_linear
+    if _compiled_chain_linear is None:
+        _compiled_chain_linear = torch.compile(_chain_linear, fullgraph=True)
+    return _compiled_chain_linear
+
+
 class TorchPerceptron(TorchModel):
     def __init__(self,
                  dim: int,
                  activation: torch.nn.modules.activation=Sigmoid,
-                 bias: bool=True):
+                 bias: bool=True,
+                 autocast: bool=False):
         """Perceptron model.
 
         Implementation of the perceptron model by Rosenblatt :cite:p:`Rosenblatt1958ThePA`.
@@ -40,28 +72,62 @@ class TorchPerceptron(TorchModel):
             The activation function of the output neuron.
         bias : bool, optional
             Whether to add a bias term to the output neuron.
+        autocast : bool, default=False
+            Whether to run the forward pass in bfloat16 mixed precision on CUDA devices.
         """
 
         super(TorchPerceptron, self).__init__()
         self.input_dim = dim
-        self.model = Sequential(OrderedDict({
-            "linear" : Linear(self.input_dim, 1, bias=bias), 
-            "sigmoid" : activation()
-        }))
+        self.autocast = autocast
+        self.linear = Linear(self.input_dim, 1, bias=bias)
+        # The default sigmoid is applied as a function (in place on the fresh linear output),
+        # any other activation as a module
+        self.activation_fn = torch.sigmoid_ if activation is Sigmoid else activation()
+
+    def jit_compile(self) -> None:
+        """Compiles the model with TorchScript.
+
+        The layers of the perceptron are replaced by their :func:`torch.jit.script` version. The
+        scripted graph has a negligible per-call overhead, which dominates the cost of the
+        forward pass of such a small model on CPU. Parameters are preserved.
+
+        Notes
+        -----
+        The scripted model cannot be pickled, hence simulations using it cannot be saved with
+        :meth:`gossipy.simul.GossipSimulator.save`. Since the string representation of the model
+        changes, the method should be called on the prototype model before building the
+        model handlers.
+        """
+
+        self.linear = torch.jit.script(self.linear)
+        if isinstance(self.activation_fn, Module):
+            self.activation_fn = torch.jit.script(self.activation_fn)
 
     # docstr-coverage:inherited
     def forward(self, x: torch.Tensor) -> torch.Tensor:
-        return self.model(x)
+        if self.autocast and x.is_cuda:
+            with _autocast():
+                return self._forward(x).float()
+        return self._forward(x)
+
+    def _forward(self, x: torch.Tensor) -> torch.Tensor:
+        linear = self.linear
+        if isinstance(linear, torch.jit.ScriptModule):
+            out = linear(x)
+        else:
+            out = F.linear(x, linear.weight, linear.bias)
+        return self.activation_fn(out)
 
     # docstr-coverage:inherited
     def init_weights(self) -> None:
-        xavier_uniform_(self.model._modules['linear'].weight)
+        xavier_uniform_(self.linear.weight)
     
     def __repr__(self) -> str:
         return str(self)
     
     def __str__(self) -> str:
-        return "TorchPerceptron(size=%d)\n%s" %(self.get_size(), str(self.model))
+        activ = "Sigmoid()" if self.activation_fn is torch.sigmoid_ else str(self.activation_fn)
+        return "TorchPerceptron(size=%d)\n%s\n%s" %(self.get_size(), str(self.linear), activ)
 
 
 class TorchMLP(TorchModel):
@@ -69,7 +135,8 @@ class TorchMLP(TorchModel):
                  input_dim: int,
                  output_dim: int,
                  hidden_dims: Tuple[int]=(100,),
-                 activation: Module=ReLU):
+                 activation: Module=ReLU,
+                 autocast: bool=False):
         """Multi-layer perceptron model.
 
         Implementation of the multi-layer perceptron model. The model is composed of a sequence of
@@ -86,21 +153,139 @@ class TorchMLP(TorchModel):
             The number of hidden neurons in each hidden layer.
         activation : torch.nn.modules.activation, default=ReLU
             The activation function of the hidden layers.
+        autocast : bool, default=False
+            Whether to run the forward pass in bfloat16 mixed precision on CUDA devices.
         """
 
         super(TorchMLP, self).__init__()
         dims = [input_dim] + list(hidden_dims)
-        layers = OrderedDict()
+        layers = []
+        # parameter-free activations (e.g., ReLU) are stateless: one instance is shared by all layers
+        activ = activation()
+        shared = not list(activ.parameters())
         for i in range(len(dims)-1):
-            layers["linear_%d" %(i+1)] = Linear(dims[i], dims[i+1])
-            layers["activ_%d" %(i+1)] = activation()
-        layers["linear_%d" %len(dims)] = Linear(dims[len(dims)-1], output_dim)
-        #layers["softmax"] = Softmax(1)
-        self.model = Sequential(layers)
+            layers.append(Linear(dims[i], dims[i+1]))
+            layers.append(activ if shared or not i else activation())
+        layers.append(Linear(dims[len(dims)-1], output_dim))
+        #layers.append(Softmax(1))
+        self.model = Sequential(*layers)
+        self.autocast = autocast
+        self._compile_mode = None
+        self._compiled = None
+        self._stacked = None
+        self._stacked_key = None
+
+    def compile_forward(self, mode: Optional[str]="reduce-overhead") -> None:
+        """Enables the compiled forward pass in evaluation mode.
+
+        The layers are lazily compiled with :func:`torch.compile` the first time the model is
+        called in evaluation mode. With the default ``mode`` the compiled graph is replayed as a
+        CUDA graph, which removes the per-layer kernel launch overhead when the model is
+        repeatedly evaluated on inputs of the same shape. Training always runs the eager model.
+
+        Parameters
+        ----------
+        mode : str or None, default="reduce-overhead"
+            The compilation mode passed to :func:`torch.compile`. If None, the compiled forward
+            pass is disabled.
+        """
+
+        self._compile_mode = mode
+        self._compiled = None
+
+    def quantize(self) -> Module:
+        """Returns an int8 dynamically quantized copy of the network for inference.
+
+        The linear layers of the network are quantized with post-training dynamic quantization,
+        i.e., weights are stored as int8 and activations are quantized on the fly. The quantized
+        network is 4 times smaller than the original one and it runs the linear layers with the
+        int8 kernels of the CPU backends (FBGEMM/QNNPACK). The model itself is left untouched.
+
+        Returns
+        -------
+        Module
+            The quantized copy of the layers of the network.
+        """
+
+        return quantize_dynamic(self.model, {Linear}, dtype=torch.qint8)
+
+    def forward_stacked(self, x: torch.Tensor) -> torch.Tensor:
+        """Forward pass that evaluates the hidden-to-hidden layers as a single compiled chain.
+
+        When all the hidden layers have the same width ``H``, the ``(H, H)`` hidden-to-hidden
+        layers are stacked and evaluated by a single function compiled with
+        :func:`torch.compile`, which avoids returning to Python between layers. The stacked
+        weights are cached and they are stacked again only when the parameters change (e.g.,
+        after an optimizer step). Gradients flow through the stacking, so the method can be used
+        for training as well. Networks without hidden layers fall back to :meth:`forward`.
+
+        Parameters
+        ----------
+        x : torch.Tensor
+            The input tensor.
+
+        Returns
+        -------
+        torch.Tensor
+            The output of the network (same as :meth:`forward`).
+        """
+
+        layers = list(self.model)
+        if len(layers) == 1:
+            return self.forward(x)
+        linears, activ = layers[::2], layers[1]
+        hidden = linears[1:-1]
+        assert len({l.weight.shape for l in hidden}) <= 1, "Hidden layers must have the same width."
+        assert not list(activ.parameters()), "The activation function must be parameter-free."
+
+        if self.autocast and x.is_cuda:
+            with _autocast():
+                return self._forward_stacked(x, linears, hidden, activ).float()
+        return self._forward_stacked(x, linears, hidden, activ)
+
+    def _forward_stacked(self,
+                         x: torch.Tensor,
+                         linears: List[Linear],
+                         hidden: List[Linear],
+                         activ: Module) -> torch.Tensor:
+        out = activ(linears[0](x))
+        if hidden:
+            weights, biases = self._stacked_hidden(hidden)
+            out = _get_compiled_chain_linear()(out, weights, biases, activ)
+        return linears[-1](out)
+
+    def _stacked_hidden(self, hidden: List[Linear]) -> Tuple[torch.Tensor, torch.Tensor]:
+        # The stacked weights are valid until a parameter is replaced, updated in place (which
+        # bumps its version counter), or the autograd mode changes
+        params = [p for l in hidden for p in (l.weight, l.bias)]
+        key = (torch.is_grad_enabled(), tuple((id(p), p._version) for p in params))
+        if self._stacked_key != key:
+            self._stacked = (torch.stack([l.weight for l in hidden]),
+                             torch.stack([l.bias for l in hidden]))
+            self._stacked_key = key
+        return self._stacked
 
     # docstr-coverage:inherited
     def forward(self, x: torch.Tensor) -> torch.Tensor:
-        return self.model(x)
+        if self._compile_mode is not None and not self.training:
+            if self._compiled is None:
+                self._compiled = torch.compile(self.model.forward,
+                                               mode=self._compile_mode,
+                                               fullgraph=True)
+            forward = self._compiled
+        else:
+            forward = self.model
+        if self.autocast and x.is_cuda:
+            with _autocast():
+                return forward(x).float()
+        return forward(x)
+
+    def __getstate__(self) -> Dict[str, Any]:
+        # the compiled function is bound to this instance: copies compile their own
+        state = dict(self.__dict__)
+        state["_compiled"] = None
+        state["_stacked"] = state["_stacked_key"] = None
+        return state
 
     # docstr-coverage:inherited
     def init_weights(self) -> None:
@@ -128,11 +313,36 @@ class AdaLine(TorchModel):
 
         super(AdaLine, self).__init__()
         self.input_dim = dim
-        self.model = torch.nn.Parameter(torch.zeros(self.input_dim), requires_grad=False)
+        # The weights are never trained with autograd: they are kept as a plain buffer
+        self.register_buffer("model", torch.zeros(self.input_dim))
 
     # docstr-coverage:inherited
     def forward(self, x: torch.Tensor) -> torch.Tensor:
-        return self.model @ x.T
+        if x.dim() == 1:
+            return torch.dot(x, self.model)
+        return torch.mv(x, self.model) if x.dim() == 2 else x @ self.model
+
+    @classmethod
+    def batched_forward(cls, weights: torch.Tensor, xs: torch.Tensor) -> torch.Tensor:
+        """Computes the predictions of several AdaLine models at once.
+
+        The predictions of ``N`` models (e.g., the models of ``N`` nodes) are computed with a
+        single batched matrix multiplication instead of ``N`` separate forward passes.
+
+        Parameters
+        ----------
+        weights : torch.Tensor
+            The stacked weights of the models, with shape ``(N, dim)``.
+        xs : torch.Tensor
+            The inputs of each model, with shape ``(N, B, dim)``.
+
+        Returns
+        -------
+        torch.Tensor
+            The predictions, with shape ``(N, B)``.
+        """
+
+        return torch.bmm(xs, weights.unsqueeze(-1)).squeeze(-1)
 
     # docstr-coverage:inherited
     def get_size(self) -> int:
@@ -145,7 +355,7 @@ class AdaLine(TorchModel):
 
 
 class LogisticRegression(TorchModel):
-    def __init__(self, input_dim: int, output_dim: int):
+    def __init__(self, input_dim: int, output_dim: int, autocast: bool=False):
         """Logistic regression model.
         
         Implementation of the logistic regression model.
@@ -156,22 +366,35 @@ class LogisticRegression(TorchModel):
             The number of input features.
         output_dim : int
             The number of output neurons.
+        autocast : bool, default=False
+            Whether to run the forward pass in bfloat16 mixed precision on CUDA devices.
         """
 
         super(LogisticRegression, self).__init__()
-        self.model = torch.nn.Linear(input_dim, output_dim)
+        # weight and bias are held directly (rather than via a Linear submodule) so that forward
+        # does not go through Module.__call__. They are initialized as in torch.nn.Linear.
+        self.input_dim = input_dim
+        self.output_dim = output_dim
+        self.autocast = autocast
+        self.weight = Parameter(torch.empty(output_dim, input_dim))
+        self.bias = Parameter(torch.empty(output_dim))
+        kaiming_uniform_(self.weight, a=math.sqrt(5))
+        bound = 1 / math.sqrt(input_dim) if input_dim > 0 else 0
+        uniform_(self.bias, -bound, bound)
 
     # docstr-coverage:inherited
     def forward(self, x: torch.Tensor) -> torch.Tensor:
-        return torch.sigmoid(self.model(x))
+        if self.autocast and x.is_cuda:
+            with _autocast():
+                return torch.sigmoid(F.linear(x, self.weight, self.bias)).float()
+        return torch.sigmoid(F.linear(x, self.weight, self.bias))
     
     # docstr-coverage:inherited
     def init_weights(self) -> None:
         pass
     
     def __str__(self) -> str:
-        return "LogisticRegression(in_size=%d, out_size=%d)" %(self.model.in_features,
-                                                               self.model.out_features)
+        return "LogisticRegression(in_size=%d, out_size=%d)" %(self.input_dim, self.output_dim)
 
 class LinearRegression(TorchModel):
     def __init__(self, input_dim: int, output_dim: int):
@@ -1,10 +1,12 @@
+from __future__ import annotations
 import math
 import torch
 import numpy as np
 from numpy.random import choice
 from collections import Counter
+from functools import lru_cache
 from torch import LongTensor
-from typing import Dict, Tuple, Optional
+from typing import Any, Dict, List, Tuple, Optional
 from torch.nn import ParameterList
 
 from .. import LOG
@@ -58,18 +60,25 @@ class TorchModelSampling:
             LOG.warning("You are using a high sample size (=%.2f) which can impact "\
                          "the performance without much advantage in terms of saved bandwith." %size)
         
-        plist = ParameterList(net.parameters())
-        probs = np.array([torch.numel(t) for t in plist], dtype='float')
-        probs /= sum(probs)
+        shapes = tuple(tuple(t.size()) for t in net.parameters())
+        probs = cls._layer_probs(shapes)
         sample_size = max(1, int(round(size * net.get_size())))
-        counter = dict(Counter(list(choice(len(plist), size=sample_size, p=probs))))
-        samples = {i : None for i in range(len(plist))}
+        counter = dict(Counter(list(choice(len(shapes), size=sample_size, p=probs))))
+        samples = {i : None for i in range(len(shapes))}
         for i, c in counter.items():
-            tensor = plist[i]
-            sizes = tuple(tensor.size())
-            samples[i] = tuple([LongTensor(list(choice(s, size=c))) for s in sizes])
+            samples[i] = tuple([torch.from_numpy(choice(s, size=c).astype(np.int64)) for s in shapes[i]])
                 
         return samples
+
+    @staticmethod
+    @lru_cache(maxsize=None)
+    def _layer_probs(shapes: Tuple[Tuple[int, ...], ...]) -> np.ndarray:
+        # Probability of sampling from each layer (proportional to its size), computed once per
+        # architecture
+        probs = np.array([math.prod(s) for s in shapes], dtype='float')
+        probs /= sum(probs)
+        probs.flags.writeable = False
+        return probs
     
 
     @classmethod
@@ -133,6 +142,12 @@ class TorchModelPartition:
         self.str_arch = str(net_proto)
         self.n_parts = min(n_parts, net_proto.get_size())
         self.partitions = self._partition(net_proto, self.n_parts)
+        self.flat_partitions, self.owners = self._flatten(net_proto)
+
+    def __deepcopy__(self, memo: Dict[int, Any]) -> TorchModelPartition:
+        # The partitioning never changes after its creation, thus all the copies of a model
+        # handler can share it
+        return self
     
     def _check(self, net: TorchModel) -> None:
         plist = ParameterList(net.parameters())
@@ -196,6 +211,21 @@ class TorchModelPartition:
                 if ni < rem: diff += 1
 
         return parts
+
+    def _flatten(self, net: TorchModel) -> Tuple[Dict[int, Dict[int, LongTensor]], List[LongTensor]]:
+        # Indices of the partitions w.r.t. the flattened layers, and the partition of each
+        # (flattened) parameter
+        plist = ParameterList(net.parameters())
+        flat_parts = {i : {} for i in self.partitions}
+        owners = [torch.full((t.numel(),), -1, dtype=torch.long) for t in plist]
+        for p, t_ids in self.partitions.items():
+            for i, ids in t_ids.items():
+                if ids is not None:
+                    flat_ids = np.ravel_multi_index([x.numpy() for x in ids], tuple(plist[i].shape))
+                    flat_parts[p][i] = torch.from_numpy(flat_ids)
+                    owners[i][flat_parts[p][i]] = p
+        assert all((o >= 0).all() for o in owners), "The partitions must cover the whole network."
+        return flat_parts, owners
     
 
     def merge(self, id_part: int,
@@ -228,7 +258,6 @@ class TorchModelPartition:
         w = weights if (weights is not None and weights != (0,0)) else (1,1)
         mul1, mul2 = w[0] / sum(w), w[1] / sum(w)
         with torch.no_grad():
-            for i in range(len(plist1)):
-                t_ids = self.partitions[id_part][i]
-                if t_ids is not None:
-                    plist1[i][t_ids] = mul1 * plist1[i][t_ids] + mul2 * plist2[i][t_ids]
+            for i, ids in self.flat_partitions[id_part].items():
+                flat1, flat2 = plist1[i].view(-1), plist2[i].view(-1)
+                flat1[ids] = mul1 * flat1[ids] + mul2 * flat2[ids]
@@ -3,16 +3,18 @@ import random
 import numpy as np
 from numpy.random import randint, normal, rand
 from numpy import ndarray
+import torch
 from torch import Tensor
-from typing import Any, Optional, Union, Dict, Tuple, Iterable
+from typing import Any, List, Optional, Union, Dict, Tuple, Iterable
 from gossipy.data import DataDispatcher
 
-from . import CACHE, LOG
+from . import CACHE, LOG, CacheKey
 from .core import AntiEntropyProtocol, CreateModelMode, MessageType, Message, P2PNetwork, ChordMessage
 from .utils import choice_not_n
 from .model.handler import ModelHandler, PartitionedTMH, SamplingTMH, WeightedTMH
 from .model.sampling import TorchModelSampling
 
+from functools import lru_cache
 from math import log2
 
 # AUTHORSHIP
@@ -34,7 +36,26 @@ __all__ = ["GossipNode",
            "ChordNode"]
 
 
+def _retrieve(value: Any) -> Any:
+    # The payload is a cache key only if gossipy.CACHE_ENABLED, otherwise it is the model itself
+    return CACHE.pop(value) if isinstance(value, CacheKey) else value
+
+
 class GossipNode():
+    # Type of the message sent with each protocol and whether it carries the local model
+    _SEND_TYPES: Dict[AntiEntropyProtocol, Tuple[MessageType, bool]] = {
+        AntiEntropyProtocol.PUSH: (MessageType.PUSH, True),
+        AntiEntropyProtocol.PULL: (MessageType.PULL, False),
+        AntiEntropyProtocol.PUSH_PULL: (MessageType.PUSH_PULL, True)
+    }
+    # Whether a received message carries a model to merge and whether it must be replied to
+    _RECV_ACTIONS: Dict[MessageType, Tuple[bool, bool]] = {
+        MessageType.PUSH: (True, False),
+        MessageType.REPLY: (True, False),
+        MessageType.PUSH_PULL: (True, True),
+        MessageType.PULL: (False, True)
+    }
+
     def __init__(self,
                  idx: int, #node's id
                  data: Union[Tuple[Tensor, Optional[Tensor]],
@@ -42,7 +63,8 @@ class GossipNode():
                  round_len: int, #round length
                  model_handler: ModelHandler, #object that handles the model learning/inference
                  p2p_net: P2PNetwork,
-                 sync: bool=True):
+                 sync: bool=True,
+                 delta: Optional[int]=None):
         r"""Class that represents a generic node in a gossip network. 
 
         A node is identified by its index and it is initialized with a fixed delay :math:`\Delta` that
@@ -72,15 +94,23 @@ class GossipNode():
             Whether the node is synchronous with the round's length. In this case, the node will 
             regularly time out at the same point in the round. If `False`, the node will time out 
             with a fixed delay. 
+        delta : int, optional
+            The node's delay :math:`\Delta`. If `None` (default), it is randomly drawn as described
+            above.
         """
 
         self.idx: int = idx
         self.data:  Union[Tuple[Tensor, Optional[Tensor]], Tuple[ndarray, Optional[ndarray]]] = data
         self.round_len: int = round_len
         self.model_handler: ModelHandler = model_handler
+        # The node's data never change, thus the presence of the test set is checked only once
+        self._has_test: bool = data[1] is not None if isinstance(data, tuple) else True
         self.sync: bool = sync
-        self.delta: int = randint(0, round_len) if sync else int(normal(round_len, round_len/20))
+        if delta is None:
+            delta = randint(0, round_len) if sync else int(normal(round_len, round_len/20))
+        self.delta: int = delta
         self.p2p_net = p2p_net
+        self._peers: Optional[Iterable[int]] = None
 
     def init_model(self, local_train: bool=True, *args, **kwargs) -> None:
         """Initializes the local model.
@@ -105,8 +135,26 @@ class GossipNode():
             The index of the randomly selected peer.
         """
 
-        peers = self.p2p_net.get_peers(self.idx)
-        return random.choice(peers) if peers else choice_not_n(0, self.p2p_net.size(), self.idx)
+        peers = self._get_peers()
+        return random.choice(peers) if len(peers) else choice_not_n(0, self.p2p_net.size(), self.idx)
+
+    def _get_peers(self) -> Iterable[int]:
+        # The peers are retrieved from the network only once (see invalidate_peers)
+        if self._peers is None:
+            self._peers = self.p2p_net.get_peers(self.idx)
+        return self._peers
+
+    def invalidate_peers(self) -> None:
+        """Invalidates the cached list of peers.
+
+        The peers of the node are retrieved from the network the first time they are needed and
+        then cached. In case of dynamic topologies, this method must be called whenever the
+        neighborhood of the node changes, together with
+        :meth:`gossipy.core.P2PNetwork.invalidate_peers` (the simulators sample the peers of the
+        nodes directly from the network).
+        """
+
+        self._peers = None
         
     def timed_out(self, t: int) -> bool:
         """Checks whether the node has timed out.
@@ -122,7 +170,38 @@ class GossipNode():
             Whether the node has timed out.
         """
         return ((t % self.round_len) == self.delta) if self.sync else ((t % self.delta) == 0)
-    
+
+    @classmethod
+    def pack(cls, nodes: Dict[int, GossipNode]) -> Dict[str, ndarray]:
+        """Packs the scheduling state of the nodes into parallel arrays.
+
+        The time outs of all the nodes can then be checked at once, i.e., a node times out at time
+        ``t`` iff ``t % period == offset``, where the period is the round length and the offset is
+        the delay for synchronous nodes, while the period is the delay and the offset is 0 for
+        asynchronous nodes (see :meth:`timed_out`).
+
+        Parameters
+        ----------
+        nodes : Dict[int, GossipNode]
+            The nodes of the network.
+
+        Returns
+        -------
+        Dict[str, ndarray]
+            The arrays ``idx``, ``sync``, ``round_len``, ``delta``, ``period`` and ``offset``, where
+            the i-th entry of each array refers to the node ``idx[i]``.
+        """
+
+        packed = {
+            "idx": np.array([idx for idx in nodes], dtype=int),
+            "sync": np.array([n.sync for n in nodes.values()], dtype=bool),
+            "round_len": np.array([n.round_len for n in nodes.values()], dtype=int),
+            "delta": np.array([n.delta for n in nodes.values()], dtype=int)
+        }
+        packed["period"] = np.where(packed["sync"], packed["round_len"], packed["delta"])
+        packed["offset"] = np.where(packed["sync"], packed["delta"], 0)
+        assert np.all(packed["period"] > 0), "Asynchronous nodes must have a positive delay."
+        return packed
 
     def send(self,
              t: int,
@@ -157,16 +236,14 @@ class GossipNode():
         :class:`gossipy.simul.GossipSimulator`
         """
 
-        if protocol == AntiEntropyProtocol.PUSH:
-            key = self.model_handler.caching(self.idx)
-            return Message(t, self.idx, peer, MessageType.PUSH, (key,))
-        elif protocol == AntiEntropyProtocol.PULL:
-            return Message(t, self.idx, peer, MessageType.PULL, None)
-        elif protocol == AntiEntropyProtocol.PUSH_PULL:
-            key = self.model_handler.caching(self.idx)
-            return Message(t, self.idx, peer, MessageType.PUSH_PULL, (key,))
-        else:
-            raise ValueError("Unknown protocol %s." %protocol)
+        if protocol not in self._SEND_TYPES:
+            raise ValueError("Unsupported protocol %s for %s." %(protocol, self.__class__.__name__))
+        msg_type, with_model = self._SEND_TYPES[protocol]
+        return Message(t, self.idx, peer, msg_type, self._payload() if with_model else None)
+
+    def _payload(self) -> Tuple[Any, ...]:
+        # The payload of the messages carrying the local model
+        return (self.model_handler.caching(self.idx),)
 
     def receive(self, t: int, msg: Message) -> Union[Message, None]:
         """Receives a message from the peer.
@@ -188,19 +265,13 @@ class GossipNode():
             The message to be sent back to the peer. If `None`, there is no message to be sent back.
         """
 
-        msg_type: MessageType
-        recv_model: Any 
-        msg_type, recv_model = msg.type, msg.value[0] if msg.value else None
-        if msg_type == MessageType.PUSH or \
-           msg_type == MessageType.REPLY or \
-           msg_type == MessageType.PUSH_PULL:
-            recv_model = CACHE.pop(recv_model)
+        do_update, do_reply = self._RECV_ACTIONS[msg.type]
+        if do_update:
+            recv_model = _retrieve(msg.value[0])
             self.model_handler(recv_model, self.data[0])
 
-        if msg_type == MessageType.PULL or \
-           msg_type == MessageType.PUSH_PULL:
-            key = self.model_handler.caching(self.idx)
-            return Message(t, self.idx, msg.sender, MessageType.REPLY, (key,))
+        if do_reply:
+            return Message(t, self.idx, msg.sender, MessageType.REPLY, self._payload())
         return None
 
     def evaluate(self, ext_data: Optional[Any]=None) -> Dict[str, float]:
@@ -218,10 +289,11 @@ class GossipNode():
             the corresponding values.
         """
 
-        if ext_data is None:
-            return self.model_handler.evaluate(self.data[1])
-        else:
-            return self.model_handler.evaluate(ext_data)
+        with torch.no_grad():
+            if ext_data is None:
+                return self.model_handler.evaluate(self.data[1])
+            else:
+                return self.model_handler.evaluate(ext_data)
     
     #CHECK: we need a more sensible check
     def has_test(self) -> bool:
@@ -233,9 +305,7 @@ class GossipNode():
             Whether the node has a test set.
         """
 
-        if isinstance(self.data, tuple):
-            return self.data[1] is not None
-        else: return True
+        return self._has_test
     
     def __repr__(self) -> str:
         return str(self)
@@ -273,14 +343,23 @@ class GossipNode():
             The generated nodes.
         """
         
+        assert p2p_net.size() <= data_dispatcher.size(), "Not enough data for all the nodes."
+        n = p2p_net.size()
+        # All the delays are drawn at once (same values as drawing them node by node)
+        if sync:
+            deltas = randint(0, round_len, size=n)
+        else:
+            deltas = normal(round_len, round_len/20, size=n).astype(int)
+
         nodes = {}
-        for idx in range(p2p_net.size()):
+        for idx, data in zip(range(n), data_dispatcher.iter_clients()):
             node = cls(idx=idx,
-                       data=data_dispatcher[idx], 
+                       data=data, 
                        round_len=round_len, 
                        model_handler=model_proto.copy(), 
                        p2p_net=p2p_net, 
                        sync=sync, 
+                       delta=int(deltas[idx]),
                        **kwargs)
             nodes[idx] = node
         return nodes    
@@ -294,36 +373,51 @@ class ChordNode(GossipNode):
                  round_len: int, #round length
                  model_handler: WeightedTMH, #object that handles the model learning/inference
                  p2p_net: P2PNetwork,
-                 sync: bool=True):
+                 sync: bool=True,
+                 delta: Optional[int]=None):
         super(ChordNode, self).__init__(idx,
                                         data,
                                         round_len,
                                         model_handler,
                                         p2p_net,
-                                        sync)
-        m = int(log2(p2p_net.size())) + 1
-        self.finger = [1]*m
-        pow2 = 1
-        cur = idx
-        # print('Nút :', idx)
-        # print('Bảng Finger: ', end='')
-        for i in range(m):
-            cur = idx + pow2
-            pow2 = pow2 + pow2
-            if cur >= p2p_net.size():
-                cur = cur - p2p_net.size()
-            self.finger[i] = cur
-        #     print(cur, end=' ')
-        # print('')
-        # print('-----------------------------------------')
-        self.finger.reverse()
+                                        sync,
+                                        delta)
+        self._finger: Optional[List[int]] = None
         self.local_cache = {}
+
+    @property
+    def finger(self) -> List[int]:
+        """The finger table of the node.
+
+        The table is built the first time it is accessed.
+
+        Returns
+        -------
+        List[int]
+            The nodes at distance :math:`2^i` from the node on the ring, farthest first.
+        """
+
+        if self._finger is None:
+            self._finger = ChordNode._finger_tables(self.p2p_net.size())[self.idx].tolist()
+        return self._finger
+
+    @finger.setter
+    def finger(self, finger: List[int]) -> None:
+        self._finger = finger
+
+    @staticmethod
+    @lru_cache(maxsize=None)
+    def _finger_tables(n: int) -> ndarray:
+        # Finger tables of all the n nodes (computed once per network size): the i-th finger of
+        # node idx is (idx + 2^i) mod n, with i = 0, ..., log2(n). Fingers are stored farthest first.
+        powers = 1 << np.arange(int(log2(n)) + 1)
+        return ((np.arange(n)[:, None] + powers[None, :]) % n)[:, ::-1]
     
     # docstr-coverage:inherited
     def timed_out(self, t: int, weights: Iterable[float]) -> int:
         tout = super().timed_out(t)
         if tout and self.local_cache:
-            self.model_handler([CACHE.pop(k) for k in self.local_cache.values()], self.data[0], weights)
+            self.model_handler([_retrieve(k) for k in self.local_cache.values()], self.data[0], weights)
             self.local_cache = {}
         return tout 
     
@@ -340,6 +434,42 @@ class ChordNode(GossipNode):
             return ChordMessage(t, sender, peer, limit, MessageType.PUSH, (key,))
         else:
             raise ValueError("ChordNode only supports PUSH protocol.")
+
+    def forward(self,
+                t: int,
+                msg: ChordMessage,
+                peer: int,
+                protocol: AntiEntropyProtocol,
+                limit: int) -> Union[ChordMessage, None]:
+        """Relays the model received with ``msg`` to ``peer``.
+
+        Parameters
+        ----------
+        t : int
+            The current timestamp.
+        msg : ChordMessage
+            The received message.
+        peer : int
+            The receiver of the relayed message.
+        protocol : AntiEntropyProtocol
+            The protocol used to relay the message. Only PUSH is supported.
+        limit : int
+            The last node of the ring segment covered by ``peer``.
+
+        Returns
+        -------
+        ChordMessage or None
+            The relayed message.
+        """
+
+        if not msg.value or isinstance(msg.value[0], CacheKey):
+            # the cache key of the sender's model is rebuilt from the sender's id
+            return self.send(t, msg.sender, peer, protocol, limit)
+        if protocol != AntiEntropyProtocol.PUSH:
+            raise ValueError("ChordNode only supports PUSH protocol.")
+        # each hop gets its own copy, since the receivers may update the model they receive
+        return ChordMessage(t, msg.sender, peer, limit, MessageType.PUSH,
+                            (msg.value[0].copy(),) + tuple(msg.value[1:]))
         
     # docstr-coverage:inherited
     def receive(self, t: int, msg: ChordMessage) -> Union[ChordMessage, None]:
@@ -349,7 +479,7 @@ class ChordNode(GossipNode):
         if msg_type == MessageType.PUSH:
             # this should never happen
             if sender in self.local_cache:
-                CACHE.pop(self.local_cache[sender])
+                _retrieve(self.local_cache[sender])
             self.local_cache[sender] = recv_model
             # return msg
         return None
@@ -364,65 +494,36 @@ class SamplingBasedNode(GossipNode):
                  round_len: int, #round length
                  model_handler: SamplingTMH, #object that handles the model learning/inference
                  p2p_net: P2PNetwork,
-                 sync=True):
+                 sync=True,
+                 delta: Optional[int]=None):
         super(SamplingBasedNode, self).__init__(idx,
                                                 data,
                                                 round_len,
                                                 model_handler,
                                                 p2p_net,
-                                                sync)
+                                                sync,
+                                                delta)
 
-    # docstr-coverage:inherited          
-    def send(self,
-             t: int,
-             peer: int,
-             protocol: AntiEntropyProtocol) -> Union[Message, None]:
-
-        if protocol == AntiEntropyProtocol.PUSH:
-            key = self.model_handler.caching(self.idx)
-            return Message(t,
-                           self.idx,
-                           peer,
-                           MessageType.PUSH,
-                           (key, self.model_handler.sample_size))
-        elif protocol == AntiEntropyProtocol.PULL:
-            return Message(t, self.idx, peer, MessageType.PULL, None)
-        elif protocol == AntiEntropyProtocol.PUSH_PULL:
-            key = self.model_handler.caching(self.idx)
-            return Message(t,
-                           self.idx,
-                           peer,
-                           MessageType.PUSH_PULL,
-                           (key, self.model_handler.sample_size))
-        else:
-            raise ValueError("Unknown protocol %s." %protocol)
+    def _payload(self) -> Tuple[Any, ...]:
+        return (self.model_handler.caching(self.idx), self.model_handler.sample_size)
 
     # docstr-coverage:inherited
     def receive(self, t: int, msg: Message) -> Union[Message, None]:
-        msg_type: MessageType
-        recv_model: Any 
-        msg_type = msg.type
-
-        if msg_type == MessageType.PUSH or \
-           msg_type == MessageType.REPLY or \
-           msg_type == MessageType.PUSH_PULL:
+        do_update, do_reply = self._RECV_ACTIONS[msg.type]
+        if do_update:
             recv_model, sample_size = msg.value
-            recv_model = CACHE.pop(recv_model)
+            recv_model = _retrieve(recv_model)
             sample = TorchModelSampling.sample(sample_size, recv_model.model)
             self.model_handler(recv_model, self.data[0], sample)
 
-        if msg_type == MessageType.PULL or \
-           msg_type == MessageType.PUSH_PULL:
-            key = self.model_handler.caching(self.idx)
-            return Message(t,
-                           self.idx,
-                           msg.sender,
-                           MessageType.REPLY,
-                           (key, self.model_handler.sample_size))
+        if do_reply:
+            return Message(t, self.idx, msg.sender, MessageType.REPLY, self._payload())
         return None
 
 # Hegedus 2021
 class PartitioningBasedNode(GossipNode):
+    _PID_BUF_SIZE: int = 256
+
     def __init__(self,
                  idx: int, #node's id
                  data: Union[Tuple[Tensor, Optional[Tensor]],
@@ -430,7 +531,8 @@ class PartitioningBasedNode(GossipNode):
                  round_len: int, #round length
                  model_handler: PartitionedTMH, #object that handles the model learning/inference
                  p2p_net: P2PNetwork,
-                 sync=True):
+                 sync=True,
+                 delta: Optional[int]=None):
         r"""Standard :class:`GossipNode` with partitioned model.
 
         This type of node has been first introduced in :cite:p:`Hegedus:2021`.
@@ -458,67 +560,48 @@ class PartitioningBasedNode(GossipNode):
             Whether the node is synchronous with the round's length. In this case, the node will 
             regularly time out at the same point in the round. If `False`, the node will time out 
             with a fixed delay. 
+        delta : int, optional
+            The node's delay. If `None` (default), it is randomly drawn (see :class:`GossipNode`).
         """
         super(PartitioningBasedNode, self).__init__(idx,
                                                     data,
                                                     round_len,
                                                     model_handler,
                                                     p2p_net,
-                                                    sync)
-
-    # docstr-coverage:inherited            
-    def send(self,
-             t: int,
-             peer: int,
-             protocol: AntiEntropyProtocol) -> Union[Message, None]:
-
-        if protocol == AntiEntropyProtocol.PUSH:
-            pid = np.random.randint(0, self.model_handler.tm_partition.n_parts)
-            key = self.model_handler.caching(self.idx)
-            return Message(t,
-                           self.idx,
-                           peer,
-                           MessageType.PUSH,
-                           (key, pid))
-        elif protocol == AntiEntropyProtocol.PULL:
-            return Message(t, self.idx, peer, MessageType.PULL, None)
-        elif protocol == AntiEntropyProtocol.PUSH_PULL:
-            pid = np.random.randint(0, self.model_handler.tm_partition.n_parts)
-            key = self.model_handler.caching(self.idx)
-            return Message(t,
-                           self.idx,
-                           peer,
-                           MessageType.PUSH_PULL,
-                           (key, pid))
-        else:
-            raise ValueError("Unknown protocol %s." %protocol)
+                                                    sync,
+                                                    delta)
+        self._pid_buf: ndarray = np.zeros(0, dtype=int)
+        self._pid_idx: int = 0
+
+    def _next_pid(self) -> int:
+        # The partition ids are drawn in batches of _PID_BUF_SIZE
+        if self._pid_idx >= len(self._pid_buf):
+            self._pid_buf = np.random.randint(0,
+                                              self.model_handler.tm_partition.n_parts,
+                                              size=self._PID_BUF_SIZE)
+            self._pid_idx = 0
+        self._pid_idx += 1
+        return int(self._pid_buf[self._pid_idx - 1])
+
+    def _payload(self) -> Tuple[Any, ...]:
+        return (self.model_handler.caching(self.idx), self._next_pid())
 
     # docstr-coverage:inherited
     def receive(self, t: int, msg: Message) -> Union[Message, None]:
-        msg_type: MessageType
-        recv_model: Any 
-        msg_type = msg.type
-
-        if msg_type == MessageType.PUSH or \
-           msg_type == MessageType.REPLY or \
-           msg_type == MessageType.PUSH_PULL:
+        do_update, do_reply = self._RECV_ACTIONS[msg.type]
+        if do_update:
             recv_model, pid = msg.value
-            recv_model = CACHE.pop(recv_model)
+            recv_model = _retrieve(recv_model)
             self.model_handler(recv_model, self.data[0], pid)
 
-        if msg_type == MessageType.PULL or \
-           msg_type == MessageType.PUSH_PULL:
-            pid = np.random.randint(0, self.model_handler.tm_partition.n_parts)
-            key = self.model_handler.caching(self.idx)
-            return Message(t,
-                           self.idx,
-                           msg.sender,
-                           MessageType.REPLY,
-                           (key, pid))
+        if do_reply:
+            return Message(t, self.idx, msg.sender, MessageType.REPLY, self._payload())
         return None
 
 # Koloskova et al. 2020
 class All2AllGossipNode(GossipNode):
+    _SEND_TYPES = {AntiEntropyProtocol.PUSH: (MessageType.PUSH, True)}
+
     def __init__(self,
                  idx: int, #node's id
                  data: Union[Tuple[Tensor, Optional[Tensor]],
@@ -526,7 +609,8 @@ class All2AllGossipNode(GossipNode):
                  round_len: int, #round length
                  model_handler: WeightedTMH, #object that handles the model learning/inference
                  p2p_net: P2PNetwork,
-                 sync: bool=True):
+                 sync: bool=True,
+                 delta: Optional[int]=None):
         r"""
         TODO
 
@@ -550,6 +634,8 @@ class All2AllGossipNode(GossipNode):
             Whether the node is synchronous with the round's length. In this case, the node will 
             regularly time out at the same point in the round. If `False`, the node will time out 
             with a fixed delay. 
+        delta : int, optional
+            The node's delay. If `None` (default), it is randomly drawn (see :class:`GossipNode`).
         use_mh : bool, default=False
             Whether to use the Metropolis-Hastings weighting scheme for the model averaging.
         """
@@ -558,7 +644,8 @@ class All2AllGossipNode(GossipNode):
                                         round_len,
                                         model_handler,
                                         p2p_net,
-                                        sync)
+                                        sync,
+                                        delta)
         self.local_cache = {}
     
     # docstr-coverage:inherited
@@ -570,23 +657,12 @@ class All2AllGossipNode(GossipNode):
             # else:
             #     n = self.p2p_net.size(self.idx)
             #     weights = [1./n] + [1. / (min(self.p2p_net.size(k), n) + 1) for k in self.local_cache]
-            self.model_handler([CACHE.pop(k) for k in self.local_cache.values()], self.data[0], weights)
+            self.model_handler([_retrieve(k) for k in self.local_cache.values()], self.data[0], weights)
             self.local_cache = {}
         return tout 
 
     def get_peers(self) -> int:
-        return self.p2p_net.get_peers(self.idx)
-
-    # docstr-coverage:inherited
-    def send(self,
-             t: int,
-             peer: int,
-             protocol: AntiEntropyProtocol) -> Union[Message, None]:
-
-        if protocol == AntiEntropyProtocol.PUSH:
-            return super().send(t, peer, protocol)
-        else:
-            raise ValueError("All2AllNode only supports PUSH protocol.")
+        return self._get_peers()
 
     # docstr-coverage:inherited
     def receive(self, t: int, msg: Message) -> Union[Message, None]:
@@ -596,7 +672,7 @@ class All2AllGossipNode(GossipNode):
         if msg_type == MessageType.PUSH:
             # this should never happen
             if sender in self.local_cache:
-                CACHE.pop(self.local_cache[sender])
+                _retrieve(self.local_cache[sender])
             self.local_cache[sender] = recv_model
 
         return None
\ No newline at end of file
@@ -351,6 +351,27 @@ class GossipSimulator(SimulationEventSender):
         self.initialized = True
         for _, node in self.nodes.items():
             node.init_model()
+
+    def _timed_out_nodes(self,
+                         packed: Dict[str, np.ndarray],
+                         rank: np.ndarray,
+                         t: int) -> List[int]:
+        # Nodes timing out at time t (see GossipNode.pack) in the (shuffled) order of the round,
+        # i.e., sorted by their position (rank) in the shuffled node ids
+        fired = packed["idx"][(t % packed["period"]) == packed["offset"]]
+        return fired[np.argsort(rank[fired], kind="stable")].tolist()
+
+    def _sample_peers(self, fired: List[int]) -> List[int]:
+        # One random peer for each fired node. The peers are sampled all at once from the network
+        # when the nodes share it and use the default GossipNode.get_peer, otherwise each node
+        # picks its own peer
+        if not fired:
+            return []
+        nodes = [self.nodes[i] for i in fired]
+        net = nodes[0].p2p_net
+        if all(type(n).get_peer is GossipNode.get_peer and n.p2p_net is net for n in nodes):
+            return net.sample_peers(np.array(fired)).tolist()
+        return [n.get_peer() for n in nodes]
     
     # def add_nodes(self, nodes: List[GossipNode]) -> None:
     #     assert not self.initialized, "'init_nodes' must be called before adding new nodes."
@@ -378,6 +399,8 @@ class GossipSimulator(SimulationEventSender):
                "The simulator is not inizialized. Please, call the method 'init_nodes'."
         LOG.info("Simulation started.")
         node_ids = np.arange(self.n_nodes)
+        rank = np.arange(self.n_nodes)
+        packed = GossipNode.pack(self.nodes)
         
         pbar = track(range(n_rounds * self.delta), description="Simulating...")
         msg_queues = DefaultDict(list)
@@ -387,12 +410,13 @@ class GossipSimulator(SimulationEventSender):
             for t in pbar:
                 if t % self.delta == 0: 
                     shuffle(node_ids)
+                    rank[node_ids] = np.arange(self.n_nodes)
                     
-                for i in node_ids:
+                fired = self._timed_out_nodes(packed, rank, t)
+                for i, peer in zip(fired, self._sample_peers(fired)):
                     node = self.nodes[i]
                     if node.timed_out(t):
 
-                        peer = node.get_peer()
                         msg = node.send(t, peer, self.protocol)
                         self.notify_message(False, msg)
                         if msg:
@@ -520,6 +544,8 @@ class ChordSimulator(GossipSimulator):
                "The simulator is not inizialized. Please, call the method 'init_nodes'."
         LOG.info("Simulation started.")
         node_ids = np.arange(self.n_nodes)
+        rank = np.arange(self.n_nodes)
+        packed = GossipNode.pack(self.nodes)
 
         total_time_step = n_rounds * self.delta
         pbar = track(range(total_time_step), description="Simulating...")
@@ -530,7 +556,8 @@ class ChordSimulator(GossipSimulator):
             for t in pbar:
                 if t % self.delta == 0: 
                     shuffle(node_ids)
-                for i in node_ids:
+                    rank[node_ids] = np.arange(self.n_nodes)
+                for i in self._timed_out_nodes(packed, rank, t):
                     node = self.nodes[i]
                     if node.timed_out(t, W_matrix[i]):
                         limit = node.idx - 1 if node.idx != 0 else self.n_nodes - 1
@@ -558,10 +585,9 @@ class ChordSimulator(GossipSimulator):
                         limit = msg.limit
                         if receiver == limit:
                             continue
-                        sender = msg.sender
                         for peer in receivernode.finger:
                             if ((peer > limit) ^ (peer < receiver) ^ (limit > receiver)) or peer == limit:
-                                msgtosend = receivernode.send(t + 1, sender, peer, self.protocol, limit)
+                                msgtosend = receivernode.forward(t + 1, msg, peer, self.protocol, limit)
                                 limit = peer - 1 if peer != 0 else self.n_nodes - 1
                                 self.notify_message(False, msgtosend)
                                 msg_cnt += 1
@@ -688,6 +714,8 @@ class TokenizedGossipSimulator(GossipSimulator):
     # docstr-coverage:inherited
     def start(self, n_rounds: int=100) -> Tuple[List[float], List[float]]:
         node_ids = np.arange(self.n_nodes)
+        rank = np.arange(self.n_nodes)
+        packed = GossipNode.pack(self.nodes)
         pbar = track(range(n_rounds * self.delta), description="Simulating...")
         msg_queues = DefaultDict(list)
         rep_queues = DefaultDict(list)
@@ -696,14 +724,15 @@ class TokenizedGossipSimulator(GossipSimulator):
             for t in pbar:
                 if t % self.delta == 0: 
                     shuffle(node_ids)
+                    rank[node_ids] = np.arange(self.n_nodes)
                     #if t > 0:
                     #    avg_tokens.append(np.mean([a.n_tokens for a in self.accounts.values()]))
                 
-                for i in node_ids:
+                fired = self._timed_out_nodes(packed, rank, t)
+                for i, peer in zip(fired, self._sample_peers(fired)):
                     node = self.nodes[i]
                     if node.timed_out(t):
                         if random() < self.accounts[i].proactive():
-                            peer = node.get_peer()
                             msg = node.send(t, peer, self.protocol)
                             self.notify_message(False, msg)
                             if msg: 
@@ -719,8 +748,10 @@ class TokenizedGossipSimulator(GossipSimulator):
                 for msg in msg_queues[t]:
                     reply = None
                     if is_online[msg.receiver]:
-                        if msg.value and isinstance(msg.value[0], CacheKey):
-                            sender_mh = CACHE[msg.value[0]]
+                        if msg.value:
+                            sender_mh = msg.value[0]
+                            if isinstance(sender_mh, CacheKey):
+                                sender_mh = CACHE[sender_mh]
                         reply = self.nodes[msg.receiver].receive(t, msg)
                         if reply:
                             if random() > self.drop_prob:
@@ -845,6 +876,8 @@ class All2AllGossipSimulator(GossipSimulator):
                "The simulator is not inizialized. Please, call the method 'init_nodes'."
         LOG.info("Simulation started.")
         node_ids = np.arange(self.n_nodes)
+        rank = np.arange(self.n_nodes)
+        packed = GossipNode.pack(self.nodes)
         
         pbar = track(range(n_rounds * self.delta), description="Simulating...")
         msg_queues = DefaultDict(list)
@@ -856,9 +889,10 @@ class All2AllGossipSimulator(GossipSimulator):
             for t in pbar:
                 if t % self.delta == 0: 
                     shuffle(node_ids)
+                    rank[node_ids] = np.arange(self.n_nodes)
 
                 
-                for i in node_ids:
+                for i in self._timed_out_nodes(packed, rank, t):
                     node = self.nodes[i]
                     if node.timed_out(t, W_matrix[i]):
                         peers = node.get_peers()